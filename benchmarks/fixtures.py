@@ -0,0 +1,91 @@
+from collections import Counter, deque
+from typing import List
+
+from enums import Role, PlayerStatus, GameStage
+from models.room import Room
+from models.system import Global
+from models.user import User
+
+
+def room_setting(players: int) -> dict:
+    """Setting with roughly one wolf per three players and every god role"""
+    god_citizen = list(Role.god_citizen_mapping().keys())
+    wolf_num = max(players // 3, 1)
+    return dict(
+        wolf_num=wolf_num,
+        god_wolf=[],
+        citizen_num=max(players - wolf_num - len(god_citizen), 1),
+        god_citizen=god_citizen,
+        witch_rule='Only the first night can save yourself',
+        guard_rule='The object dies when guarded and rescued at the same time',
+    )
+
+
+def make_user(nick: str, room: Room) -> User:
+    """User without a PyWebIO session, game_msg is a plain list"""
+    return User(nick=nick, main_task_id=None, input_blocking=False, room=room, role=None,
+                skill=dict(), status=None, game_msg=list(), game_msg_syncer=None, chat_inbox=deque())
+
+
+def make_room(players: int, started=True) -> Room:
+    """
+    Room filled with players, roles assigned in seat order when started
+
+    The room is taken back out of the registry and its id cleared, so it can be passed to Global.reg_room
+    """
+    room = Room.alloc(room_setting(players))
+    Global.remove_room(room.id)
+    room.id = None
+    for idx in range(len(room.roles)):
+        user = make_user(f'p{idx}', room)
+        room.players[user.nick] = user
+    if started:
+        room.started = True
+        for user, role in zip(room.players.values(), sorted(room.roles, key=lambda r: r.name)):
+            user.role = role
+            user.status = PlayerStatus.ALIVE
+            if role == Role.WITCH:
+                user.skill.update(heal=True, poison=True)
+            if role == Role.GUARD:
+                user.skill['last_protect'] = None
+        room.roles_pool = []
+    room.players_changed()
+    return room
+
+
+def act(room: Room, stage: GameStage, action: str, *args):
+    """Run a player action of the stage the way night_logic would"""
+    room.stage = stage
+    room.waiting = True
+    for user in room.players.values():
+        if user.should_act():
+            getattr(user, action)(*args)
+            break
+    room.waiting = False
+
+
+def play_scripted_game(players: int) -> Counter:
+    """
+    Play a full deterministic game without sessions or sleeps
+
+    Wolves kill the first alive good player, the witch saves on the first night only,
+    the guard protects the first alive player, the day vote eliminates the first alive wolf.
+    """
+    room = make_room(players)
+    while room.started:
+        room.round += 1
+        alive: List[User] = room.list_alive_players()
+        good = [user for user in alive if user.role not in [Role.WOLF, Role.WOLF_KING]]
+        act(room, GameStage.WOLF, 'wolf_kill_player', good[0].nick)
+        if room.round == 1:
+            act(room, GameStage.WITCH, 'witch_heal_player', good[0].nick)
+        act(room, GameStage.GUARD, 'guard_protect_player', alive[0].nick)
+        room.check_result()
+        if not room.started:
+            break
+
+        wolves = [user for user in room.list_alive_players() if user.role in [Role.WOLF, Role.WOLF_KING]]
+        wolves[0].status = PlayerStatus.DEAD
+        room.check_result(is_vote_check=True)
+        room.enter_null_stage()
+    return Counter(text for _, text in room.log)
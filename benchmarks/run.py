@@ -0,0 +1,207 @@
+"""
+Microbenchmarks for the game hot paths
+
+    python -m benchmarks.run                  # run and compare with the saved baseline
+    python -m benchmarks.run --save           # run and store the results as the new baseline
+    python -m benchmarks.run -k room --threshold 0.1 --threshold-for scripted_game=0.5
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+from enums import Role, GameStage, PlayerStatus
+from models.system import Global
+from benchmarks.fixtures import make_room, play_scripted_game
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+PLAYER_COUNTS = [8, 12, 24, 48]
+
+# name -> (setup(size) -> timed callable, sizes)
+CASES: Dict[str, Tuple[Callable, list]] = dict()
+
+
+def bench(name: str, sizes: list):
+    def decorator(setup):
+        CASES[name] = (setup, sizes)
+        return setup
+
+    return decorator
+
+
+@bench('user_should_act', PLAYER_COUNTS)
+def _should_act(players):
+    room = make_room(players)
+    room.stage = GameStage.WOLF
+    users = list(room.players.values())
+    return lambda: [user.should_act() for user in users]
+
+
+@bench('room_list_alive_players', PLAYER_COUNTS)
+def _list_alive_players(players):
+    room = make_room(players)
+    for user in list(room.players.values())[::2]:
+        user.status = PlayerStatus.DEAD
+    return room.list_alive_players
+
+
+@bench('room_check_result', PLAYER_COUNTS)
+def _check_result(players):
+    room = make_room(players)
+
+    def run():
+        room.check_result()
+        room.compact_log(0)
+
+    return run
+
+
+@bench('global_reg_room', [10, 1000, 10000])
+def _reg_room(rooms):
+    Global.rooms.clear()
+    for _ in range(rooms):
+        Global.reg_room(make_room(6, started=False))
+
+    room = make_room(6, started=False)
+
+    def run():
+        Global.reg_room(room)
+        Global.remove_room(room.id)
+        room.id = None
+
+    return run
+
+
+@bench('role_from_option', [1, 10, 100])
+def _role_from_option(options):
+    names = (list(Role.mapping().keys()) * options)[:options]
+    return lambda: (Role.from_option(names), Role.mapping())
+
+
+@bench('room_log_fanout', [(8, 10), (12, 10), (24, 100), (48, 100)])
+def _log_fanout(size):
+    players, messages = size
+    room = make_room(players)
+    users = list(room.players.values())
+
+    def run():
+        room.compact_log(0)
+        for user in users:
+            user.game_msg.clear()
+        for idx in range(messages):
+            if idx % 2:
+                room.broadcast_msg(f'message {idx}')
+            else:
+                room.send_msg(f'message {idx}', nick=users[idx % players].nick)
+        for user in users:
+            user._sync_game_msg(0)
+
+    return run
+
+
+@bench('chat_post', PLAYER_COUNTS)
+def _chat_post(players):
+    room = make_room(players)
+    room.stage = GameStage.Day
+    channel = room.chat['all']
+    channel.sent.clear()
+    nicks = list(channel.members)
+
+    def run():
+        for nick in nicks:
+            channel.post(room, nick, 'hello')
+            channel.sent.clear()
+        for user in room.players.values():
+            user.chat_inbox.clear()
+
+    return run
+
+
+@bench('scripted_game', [9, 12, 24])
+def _scripted_game(players):
+    return lambda: play_scripted_game(players)
+
+
+def measure(func: Callable, repeat: int) -> float:
+    """Best time of one call, in seconds"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run_cases(pattern: str, repeat: int, seed: int) -> Dict[str, float]:
+    results = dict()
+    for name, (setup, sizes) in CASES.items():
+        if pattern not in name:
+            continue
+        rooms = dict(Global.rooms)
+        for size in sizes:
+            # Every case sees the same room ids and room seeds on every run
+            Global.seed(seed)
+            key = f'{name}[{size}]'
+            results[key] = measure(setup(size), repeat)
+            print(f'{key:<36} {results[key] * 1e6:>12.2f} us')
+        Global.rooms = rooms
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            threshold: float, overrides: Dict[str, float]) -> List[str]:
+    """Return the benchmarks slower than baseline * (1 + threshold)"""
+    regressions = []
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        limit = overrides.get(key.split('[')[0], threshold)
+        change = value / baseline[key] - 1
+        print(f'{key:<36} {change:>+8.1%} (limit {limit:+.0%})')
+        if change > limit:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Werewolf microbenchmarks')
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0, help='server seed used for every benchmark')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 means 20%%')
+    parser.add_argument('--threshold-for', action='append', default=[], metavar='NAME=VALUE',
+                        help='per benchmark threshold override')
+    args = parser.parse_args(argv)
+
+    # TTS warnings and room logs would dominate the timings
+    logging.disable(logging.CRITICAL)
+    results = run_cases(args.pattern, args.repeat, args.seed)
+
+    if args.save:
+        baseline = dict()
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline, run with --save first')
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    overrides = {name: float(value) for name, value in (item.split('=') for item in args.threshold_for)}
+    regressions = compare(results, baseline, args.threshold, overrides)
+    if regressions:
+        print(f'Regressions: {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -136,3 +136,55 @@ class GuardRule(Enum):
             'The object dies when guarded and rescued at the same time': cls.MED_CONFLICT,
             'The object survives when being guarded and rescued at the same time': cls.NO_MED_CONFLICT,
         }
+
+
+class NightRule(Enum):
+    SEQUENTIAL = 'Roles act one after another'
+    CONCURRENT = 'Wolves, prophet and guard act at the same time'
+
+    @classmethod
+    def as_options(cls) -> list:
+        return list(cls.mapping().keys())
+
+    @classmethod
+    def from_option(cls, option: Union[str, list]):
+        if isinstance(option, list):
+            return [cls.mapping()[item] for item in option]
+        elif isinstance(option, str):
+            return cls.mapping()[option]
+        else:
+            raise NotImplementedError
+
+    @classmethod
+    def mapping(cls) -> dict:
+        return {
+            'Roles act one after another': cls.SEQUENTIAL,
+            'Wolves, prophet and guard act at the same time': cls.CONCURRENT,
+        }
+
+
+class WolfVoteRule(Enum):
+    FIRST = 'The first wolf to choose decides'
+    MAJORITY = 'More than half of the wolves decide'
+    UNANIMOUS = 'All wolves must agree'
+
+    @classmethod
+    def as_options(cls) -> list:
+        return list(cls.mapping().keys())
+
+    @classmethod
+    def from_option(cls, option: Union[str, list]):
+        if isinstance(option, list):
+            return [cls.mapping()[item] for item in option]
+        elif isinstance(option, str):
+            return cls.mapping()[option]
+        else:
+            raise NotImplementedError
+
+    @classmethod
+    def mapping(cls) -> dict:
+        return {
+            'The first wolf to choose decides': cls.FIRST,
+            'More than half of the wolves decide': cls.MAJORITY,
+            'All wolves must agree': cls.UNANIMOUS,
+        }
@@ -1,26 +1,49 @@
+import time
+
+_STARTED = time.perf_counter()
+
+import argparse
 import asyncio
-import sys
-from logging import getLogger, basicConfig
+import os
+import signal
+from logging import getLogger
 
 from pywebio import start_server
 from pywebio.input import *
 from pywebio.output import *
-from pywebio.session import defer_call, get_current_task_id
+from pywebio.session import defer_call, get_current_task_id, run_js
 
-from enums import WitchRule, GuardRule, Role, GameStage
+from enums import WitchRule, GuardRule, NightRule, WolfVoteRule, Role, GameStage
+from models.lifecycle import Lifecycle
+from models.matchmaking import Matchmaker
+from models.memory import memory_report, session_footprint, Tracemalloc
 from models.room import Room
+from models.system import Config, Global
 from models.user import User
-from utils import add_cancel_button, get_interface_ip
+from utils import get_interface_ip, setup_logging, configure_backends, StartupProfile, log_drop_count
 
-basicConfig(stream=sys.stdout,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = getLogger('Wolf')
 logger.setLevel('DEBUG')
 
+WITCH_MODES = ['antidote', 'poison']
+
+
+def handoff() -> bool:
+    """Send the session to the replacement server while draining, return True if the session should end"""
+    if not Global.draining:
+        return False
+    put_text('The server is restarting, please reconnect in a moment')
+    if Config.HANDOFF_URL:
+        run_js('window.location.href = url', url=Config.HANDOFF_URL)
+    return True
+
 
 async def main():
     """Werewolf kill"""
+    Lifecycle.start_reaper()
     put_markdown("## werewolf kill judge")
+    if handoff():
+        return
 
     current_user = User.alloc(
         await input('Please enter your nickname',
@@ -36,9 +59,12 @@ async def main():
 
     put_text(f'Hello, {current_user.nick}')
     data = await input_group(
-        'Lobby', inputs=[actions(name='cmd', buttons=['Create room', 'Join room'])]
+        'Lobby', inputs=[actions(name='cmd', buttons=['Create room', 'Join room', 'Quick match'])]
     )
 
+    if handoff():
+        return
+
     if data['cmd'] == 'Create room':
         room_config = await input_group('Room settings', inputs=[
             input(name='wolf_num', label='Number of ordinary wolves',
@@ -53,10 +79,33 @@ async def main():
                    options=WitchRule.as_options()),
             select(name='guard_rule', label='Guard Rule',
                    options=GuardRule.as_options()),
+            select(name='night_rule', label='Night Rule',
+                   options=NightRule.as_options()),
+            select(name='wolf_vote_rule', label='Wolf Kill Rule',
+                   options=WolfVoteRule.as_options()),
         ])
+        if handoff():
+            return
         room = Room.alloc(room_config)
     elif data['cmd'] == 'Join room':
         room = Room.get(await input('room number', type=TEXT, validate=Room.validate_room_join))
+    elif data['cmd'] == 'Quick match':
+        preset = await select('Preferred setup', options=Matchmaker.presets())
+        ticket = Matchmaker.enqueue(current_user, preset)
+        # Cancels the latest ticket, the player is queued again if the matched room closes first
+        defer_call(lambda: Matchmaker.cancel(ticket))
+        put_text('Waiting for other players...')
+        room = None
+        while room is None:
+            while ticket.room is None:
+                await asyncio.sleep(0.5)
+                if handoff():
+                    return
+                Matchmaker.match()
+            room = Matchmaker.claim(ticket)
+            if room is None:
+                put_text('The room closed before you joined, waiting for other players...')
+                ticket = Matchmaker.enqueue(current_user, preset)
     else:
         raise NotImplementedError
 
@@ -64,9 +113,15 @@ async def main():
     current_user.game_msg.append(put_text(room.desc()))
 
     room.add_player(current_user)
+    if room.auto_start and room.is_full():
+        await room.start_game()
 
     while True:
         await asyncio.sleep(0.2)
+        if room.closed:
+            put_text('The room has been closed')
+            break
+
         # Non-night homeowner operation
         host_ops = []
         if current_user is room.get_host():
@@ -76,80 +131,86 @@ async def main():
                             'Start game'], help_text='You are the host')
                 ]
             elif room.stage == GameStage.Day and room.round > 0:
-                host_ops = [
+                host_ops = room.stage_inputs(GameStage.Day, lambda buttons: [
                     actions(
                         name='host_vote_op',
-                        buttons=[
-                            user.nick for user in room.list_alive_players()],
+                        buttons=buttons,
                         help_text='You are the homeowner, you need to choose a player to be eliminated in this round'
                     )
-                ]
+                ])
 
         # player action
         user_ops = []
         if room.started:
-            if room.stage == GameStage.WOLF and current_user.should_act():
-                user_ops = [
+            stage = current_user.acting_stage()
+            if stage == GameStage.WOLF:
+                user_ops = room.stage_inputs(GameStage.WOLF, lambda buttons: [
                     actions(
                         name='wolf_team_op',
-                        buttons=add_cancel_button(
-                            [user.nick for user in room.list_alive_players()]),
+                        buttons=buttons,
                         help_text='Werewolf camp, please select the target to kill. '
                     )
-                ]
-            if room.stage == GameStage.DETECTIVE and current_user.should_act():
-                user_ops = [
+                ])
+            if stage == GameStage.DETECTIVE:
+                user_ops = room.stage_inputs(GameStage.DETECTIVE, lambda buttons: [
                     actions(
                         name='detective_team_op',
-                        buttons=[
-                            user.nick for user in room.list_alive_players()],
+                        buttons=buttons,
                         help_text='Prophet, please select the object to check. '
                     )
-                ]
-            if room.stage == GameStage.WITCH and current_user.should_act():
+                ])
+            if stage == GameStage.WITCH:
                 if current_user.witch_has_heal():
                     current_user.send_msg(
                         f' was killed last night is {room.list_pending_kill_players()}')
                 else:
                     current_user.send_msg('You have no antidote')
 
-                user_ops = [
-                    radio(name='witch_mode', options=[
-                          'antidote', 'poison'], required=True, inline=True),
+                user_ops = room.stage_inputs(GameStage.WITCH, lambda buttons: [
+                    radio(name='witch_mode', options=WITCH_MODES, required=True, inline=True),
                     actions(
                         name='witch_team_op',
-                        buttons=add_cancel_button(
-                            [user.nick for user in room.list_alive_players()]),
+                        buttons=buttons,
                         help_text='Witch, please choose your action. '
                     )
-                ]
-            if room.stage == GameStage.GUARD and current_user.should_act():
-                user_ops = [
+                ])
+            if stage == GameStage.GUARD:
+                user_ops = room.stage_inputs(GameStage.GUARD, lambda buttons: [
                     actions(
                         name='guard_team_op',
-                        buttons=add_cancel_button(
-                            [user.nick for user in room.list_alive_players()]),
+                        buttons=buttons,
                         help_text='Guard, please choose your action. '
                     )
-                ]
-            if room.stage == GameStage.HUNTER and current_user.should_act():
+                ])
+            if stage == GameStage.HUNTER:
                 current_user.hunter_gun_status()
 
-        ops = host_ops + user_ops
+        # chat
+        chat_ops = []
+        channel = room.chat_channel_for(current_user)
+        if channel is not None:
+            chat_ops = [input(name='chat', label=f'Chat ({channel.name})')]
+
+        ops = host_ops + user_ops + chat_ops
         if not ops:
             continue
 
         # UI
-        if host_ops + user_ops:
-            current_user.input_blocking = True
-        data = await input_group('Operation', inputs=host_ops + user_ops, cancelable=True)
+        current_user.input_blocking = True
+        data = await input_group('Operation', inputs=ops, cancelable=True)
         current_user.input_blocking = False
 
         # Canceled
         if data is None:
-            current_user.skip()
+            # Forms without a stage action are also cancelled remotely on stage changes, that is not a skip
+            if user_ops:
+                current_user.skip()
             continue
 
+        # Chat
+        if data.get('chat'):
+            current_user.chat(data.get('chat'))
+
         # Host logic
         if data.get('host_op') == 'Start game':
             await room.start_game()
@@ -173,7 +234,73 @@ async def main():
             current_user.guard_protect_player(nick=data.get('guard_team_op'))
 
 
+async def admin():
+    """Server administration"""
+    put_markdown("## werewolf kill admin")
+    if Config.ADMIN_TOKEN is None or await input('Admin token', type=PASSWORD) != Config.ADMIN_TOKEN:
+        put_text('Access denied')
+        return
+
+    while True:
+        put_text(f'{len(Global.rooms)} rooms, {len(Global.users)} users, '
+                 f'{"draining" if Global.draining else "serving"}, {log_drop_count()} log records dropped')
+        data = await input_group('Operation', inputs=[
+            actions(name='cmd', buttons=['Refresh', 'Memory', 'Snapshot diff', 'Drain'])
+        ])
+        if data['cmd'] == 'Memory':
+            report = memory_report()
+            put_table([
+                [room_id, usage['total'], usage['log'], usage['log_entries'], usage['players'], usage['task_count']]
+                for room_id, usage in report.items()
+            ], header=['Room', 'Bytes', 'Log bytes', 'Log entries', 'Player bytes', 'Tasks'])
+            put_table([
+                [nick, session_footprint(user)['total'], user.room.id if user.room else '-']
+                for nick, user in list(Global.users.items())
+            ], header=['User', 'Bytes', 'Room'])
+        if data['cmd'] == 'Snapshot diff':
+            put_code('\n'.join(Tracemalloc.snapshot_diff()))
+        if data['cmd'] == 'Drain':
+            Lifecycle.start_drain()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Werewolf kill judge server')
+    parser.add_argument('--host', default=Config.HOST)
+    parser.add_argument('--port', type=int, default=Config.PORT)
+    parser.add_argument('--seed', type=int, default=Config.SEED, help='server seed, see Global.seed')
+    parser.add_argument('--tts', default=Config.TTS_BACKEND, help='TTS backend, picked by platform by default')
+    parser.add_argument('--address', default=Config.ADDRESS_BACKEND, help='address discovery backend')
+    parser.add_argument('--handoff-url', default=Config.HANDOFF_URL,
+                        help='address of the replacement server, sessions are sent there while draining')
+    parser.add_argument('--admin-token', default=os.environ.get('WEREWOLF_ADMIN_TOKEN', Config.ADMIN_TOKEN),
+                        help='enables the admin app (?app=admin), defaults to $WEREWOLF_ADMIN_TOKEN')
+    parser.add_argument('--drain-timeout', type=float, default=Config.DRAIN_TIMEOUT,
+                        help='seconds to wait for running games when draining')
+    parser.add_argument('--profile-startup', action='store_true', help='print the startup time report')
+    args = parser.parse_args()
+    Config.HANDOFF_URL = args.handoff_url
+    Config.ADMIN_TOKEN = args.admin_token
+    Config.DRAIN_TIMEOUT = args.drain_timeout
+
+    profile = StartupProfile(_STARTED)
+    profile.mark('imports')
+    setup_logging(mode=Config.LOG_MODE, fmt=Config.LOG_FORMAT,
+                  queue_size=Config.LOG_QUEUE_SIZE, debug_rate=Config.LOG_DEBUG_RATE)
+    profile.mark('logging')
+    configure_backends(tts=args.tts, address=args.address)
+    Global.seed(args.seed)
+    if Config.DRAIN_SIGNAL:
+        from tornado.ioloop import IOLoop
+
+        signal.signal(getattr(signal, Config.DRAIN_SIGNAL),
+                      lambda *_: IOLoop.current().add_callback_from_signal(Lifecycle.start_drain))
+    profile.mark('configuration')
+    address = get_interface_ip()
+    profile.mark('address discovery')
+    if args.profile_startup:
+        logger.info(f'Startup profile:\n{profile.report()}')
+
     logger.info(
-        f"The Werewolf Killing Server was started successfully! You can join the game by entering http://{get_interface_ip()} in the browser")
-    start_server(main, debug=False, host='0.0.0.0', port=80, cdn=False)
+        f"The Werewolf Killing Server was started successfully! You can join the game by entering "
+        f"http://{address}{'' if args.port == 80 else f':{args.port}'} in the browser")
+    start_server({'index': main, 'admin': admin}, debug=False, host=args.host, port=args.port, cdn=False)
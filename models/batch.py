@@ -0,0 +1,257 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from enums import Role, PlayerStatus, WitchRule, GuardRule, GameStage
+from models.room import Room
+from models.system import Global
+from models.user import User
+
+# Integer codes used by the array representation, seats padded with NO_SEAT role are ignored
+ROLE_CODES = {role: code for code, role in enumerate(Role)}
+STATUS_CODES = {status: code for code, status in enumerate(PlayerStatus)}
+CODE_ROLES = {code: role for role, code in ROLE_CODES.items()}
+CODE_STATUSES = {code: status for status, code in STATUS_CODES.items()}
+NO_SEAT = -1  # Padding role code / empty target / no last protect
+
+WITCH_SKIP = 0
+WITCH_HEAL = 1
+WITCH_POISON = 2
+
+ONGOING = 0
+WOLF_WIN = 1
+GOOD_WIN = 2
+
+_ALIVE = STATUS_CODES[PlayerStatus.ALIVE]
+_DEAD = STATUS_CODES[PlayerStatus.DEAD]
+_PENDING_DEAD = STATUS_CODES[PlayerStatus.PENDING_DEAD]
+_PENDING_HEAL = STATUS_CODES[PlayerStatus.PENDING_HEAL]
+_PENDING_POISON = STATUS_CODES[PlayerStatus.PENDING_POISON]
+_PENDING_GUARD = STATUS_CODES[PlayerStatus.PENDING_GUARD]
+_WOLF_CODES = [ROLE_CODES[Role.WOLF], ROLE_CODES[Role.WOLF_KING]]
+
+
+@dataclass
+class BatchGames:
+    """N games of P seats each, one row per game"""
+    roles: np.ndarray  # (N, P) role codes
+    status: np.ndarray  # (N, P) status codes
+    heal: np.ndarray  # (N,) witch holds the antidote
+    poison: np.ndarray  # (N,) witch holds the poison
+    last_protect: np.ndarray  # (N,) seat guarded last night or NO_SEAT
+    round: np.ndarray  # (N,) finished nights
+    outcome: np.ndarray  # (N,) ONGOING / WOLF_WIN / GOOD_WIN, decided games are no longer resolved
+    witch_rule: WitchRule
+    guard_rule: GuardRule
+
+    @classmethod
+    def random(cls, n: int, roles: List[Role], witch_rule: WitchRule, guard_rule: GuardRule,
+               seed: Optional[int] = None) -> 'BatchGames':
+        """N freshly started games with the roles shuffled over the seats"""
+        rng = np.random.default_rng(seed)
+        codes = np.array([ROLE_CODES[role] for role in roles], dtype=np.int8)
+        return cls(
+            roles=rng.permuted(np.tile(codes, (n, 1)), axis=1),
+            status=np.full((n, len(roles)), _ALIVE, dtype=np.int8),
+            heal=np.ones(n, dtype=bool),
+            poison=np.ones(n, dtype=bool),
+            last_protect=np.full(n, NO_SEAT, dtype=np.int64),
+            round=np.zeros(n, dtype=np.int64),
+            outcome=np.full(n, ONGOING, dtype=np.int64),
+            witch_rule=witch_rule,
+            guard_rule=guard_rule,
+        )
+
+    def seat_of(self, role: Role) -> np.ndarray:
+        """First seat holding the role in each game, NO_SEAT if absent"""
+        mask = self.roles == ROLE_CODES[role]
+        return np.where(mask.any(axis=1), mask.argmax(axis=1), NO_SEAT)
+
+    def random_actions(self, seed: Optional[int] = None) -> 'NightActions':
+        """Uniformly random targets among players that are not out"""
+        rng = np.random.default_rng(seed)
+        n, p = self.status.shape
+
+        def pick():
+            # Random non-DEAD seat per game, assumes at least one player is alive
+            weights = np.where((self.status != _DEAD) & (self.roles != NO_SEAT), rng.random((n, p)), -1)
+            return weights.argmax(axis=1)
+
+        return NightActions(
+            wolf_target=pick(),
+            witch_mode=rng.integers(WITCH_SKIP, WITCH_POISON + 1, n),
+            witch_target=pick(),
+            guard_target=np.where(rng.random(n) < 0.8, pick(), NO_SEAT),
+        )
+
+
+@dataclass
+class NightActions:
+    """One night of player decisions per game, NO_SEAT target means the player skipped"""
+    wolf_target: np.ndarray  # (N,)
+    witch_mode: np.ndarray  # (N,) WITCH_SKIP / WITCH_HEAL / WITCH_POISON
+    witch_target: np.ndarray  # (N,)
+    guard_target: np.ndarray  # (N,)
+
+
+def _can_act(status: np.ndarray, seat: np.ndarray) -> np.ndarray:
+    """Role is in the game and its player is not out, see User.should_act"""
+    rows = np.arange(len(seat))
+    return (seat != NO_SEAT) & (status[rows, np.maximum(seat, 0)] != _DEAD)
+
+
+def apply_night(games: BatchGames, actions: NightActions) -> np.ndarray:
+    """
+    Apply wolf, witch and guard actions of one night, return the pending status codes
+
+    Mirrors the scalar player actions in night order, a rejected action counts as a skip.
+    Like the scalar engine, potions and the last protected seat are read but not consumed.
+    """
+    status = games.status.copy()
+    rows = np.arange(len(status))
+    night = games.round + 1
+
+    # werewolf, like the witch and guard only when a wolf can act
+    wolf_acts = (np.isin(games.roles, _WOLF_CODES) & (status != _DEAD)).any(axis=1)
+    kill = wolf_acts & (actions.wolf_target != NO_SEAT)
+    status[rows[kill], actions.wolf_target[kill]] = _PENDING_DEAD
+
+    # witch
+    witch = games.seat_of(Role.WITCH)
+    witch_acts = _can_act(status, witch) & (actions.witch_target != NO_SEAT)
+    heal = witch_acts & (actions.witch_mode == WITCH_HEAL) & games.heal
+    self_rescue = actions.witch_target == witch
+    if games.witch_rule == WitchRule.NO_SELF_RESCUE:
+        heal &= ~self_rescue
+    if games.witch_rule == WitchRule.SELF_RESCUE_FIRST_NIGHT_ONLY:
+        heal &= ~self_rescue | (night == 1)
+    status[rows[heal], actions.witch_target[heal]] = _PENDING_HEAL
+    poison = witch_acts & (actions.witch_mode == WITCH_POISON) & games.poison
+    status[rows[poison], actions.witch_target[poison]] = _PENDING_POISON
+
+    # guard
+    guard = games.seat_of(Role.GUARD)
+    guard_acts = _can_act(status, guard) & (actions.guard_target != NO_SEAT) & \
+        (actions.guard_target != games.last_protect)
+    target_status = status[rows, np.maximum(actions.guard_target, 0)]
+    conflict = guard_acts & (target_status == _PENDING_HEAL) & (games.guard_rule == GuardRule.MED_CONFLICT)
+    protect = guard_acts & ~conflict & (target_status != _PENDING_POISON)
+    status[rows[conflict], actions.guard_target[conflict]] = _PENDING_DEAD
+    status[rows[protect], actions.guard_target[protect]] = _PENDING_GUARD
+
+    return status
+
+
+def settle(games: BatchGames, pending: np.ndarray):
+    """Vectorized Room.check_result, return (status codes, outcome per game)"""
+    survive = np.isin(pending, [_ALIVE, _PENDING_HEAL, _PENDING_GUARD])
+    out = np.isin(pending, [_PENDING_DEAD, _PENDING_POISON])
+    status = np.where(survive, _ALIVE, np.where(out, _DEAD, pending)).astype(pending.dtype)
+
+    wolf = np.isin(games.roles, _WOLF_CODES)
+    citizen = games.roles == ROLE_CODES[Role.CITIZEN]
+    god = ~wolf & ~citizen & (games.roles != NO_SEAT)
+    wolf_alive = (survive & wolf).any(axis=1)
+    citizen_alive = (survive & citizen).any(axis=1)
+    god_alive = (survive & god).any(axis=1)
+
+    outcome = np.where(
+        ~citizen_alive | (god.any(axis=1) & ~god_alive), WOLF_WIN,
+        np.where(~wolf_alive, GOOD_WIN, ONGOING)
+    )
+    return status, outcome
+
+
+def resolve_night(games: BatchGames, actions: NightActions) -> np.ndarray:
+    """Resolve one night for every game still ongoing in place, return the outcome per game"""
+    status, outcome = settle(games, apply_night(games, actions))
+    ongoing = games.outcome == ONGOING
+    games.status = np.where(ongoing[:, None], status, games.status)
+    games.outcome = np.where(ongoing, outcome, games.outcome)
+    games.round += ongoing
+    return games.outcome
+
+
+def _scalar_room(games: BatchGames, idx: int) -> Room:
+    """Build a started scalar Room from one row of the batch"""
+    roles = [CODE_ROLES[code] for code in games.roles[idx] if code != NO_SEAT]
+    option = {role: name for name, role in Role.mapping().items()}
+    room = Room.alloc(dict(
+        wolf_num=roles.count(Role.WOLF),
+        citizen_num=roles.count(Role.CITIZEN),
+        god_wolf=[option[role] for role in roles if role in Role.god_wolf_mapping().values()],
+        god_citizen=[option[role] for role in roles if role in Role.god_citizen_mapping().values()],
+        witch_rule={v: k for k, v in WitchRule.mapping().items()}[games.witch_rule],
+        guard_rule={v: k for k, v in GuardRule.mapping().items()}[games.guard_rule],
+    ))
+    Global.remove_room(room.id)
+    room.started = True
+    room.round = int(games.round[idx])
+
+    for seat, code in enumerate(games.roles[idx]):
+        if code == NO_SEAT:
+            continue
+        user = User(nick=f'p{seat}', main_task_id=None, input_blocking=False, room=room,
+                    role=CODE_ROLES[code], skill=dict(), status=CODE_STATUSES[games.status[idx, seat]],
+                    game_msg=None, game_msg_syncer=None, chat_inbox=deque())
+        if user.role == Role.WITCH:
+            user.skill['heal'] = bool(games.heal[idx])
+            user.skill['poison'] = bool(games.poison[idx])
+        if user.role == Role.GUARD:
+            last_protect = games.last_protect[idx]
+            user.skill['last_protect'] = None if last_protect == NO_SEAT else f'p{last_protect}'
+        room.players[user.nick] = user
+    room.players_changed()
+    return room
+
+
+def _scalar_act(room: Room, stage: GameStage, action: str, *args):
+    """Run a player action the way night_logic would, on the first player allowed to act"""
+    room.stage = stage
+    room.waiting = True
+    for user in room.players.values():
+        if user.should_act():
+            getattr(user, action)(*args)
+            break
+    room.waiting = False
+
+
+def cross_check(games: BatchGames, actions: NightActions) -> List[int]:
+    """Replay the night of every ongoing game with the scalar engine, return the indexes of games that disagree"""
+    pending = apply_night(games, actions)
+    status, outcome = settle(games, pending)
+    mismatched = []
+    for idx in np.flatnonzero(games.outcome == ONGOING):
+        room = _scalar_room(games, idx)
+        room.round += 1
+
+        if actions.wolf_target[idx] != NO_SEAT:
+            _scalar_act(room, GameStage.WOLF, 'wolf_kill_player', f'p{actions.wolf_target[idx]}')
+        if actions.witch_target[idx] != NO_SEAT:
+            if actions.witch_mode[idx] == WITCH_HEAL:
+                _scalar_act(room, GameStage.WITCH, 'witch_heal_player', f'p{actions.witch_target[idx]}')
+            if actions.witch_mode[idx] == WITCH_POISON:
+                _scalar_act(room, GameStage.WITCH, 'witch_kill_player', f'p{actions.witch_target[idx]}')
+        if actions.guard_target[idx] != NO_SEAT:
+            _scalar_act(room, GameStage.GUARD, 'guard_protect_player', f'p{actions.guard_target[idx]}')
+
+        scalar_pending = [STATUS_CODES[room.players[f'p{seat}'].status]
+                          for seat, code in enumerate(games.roles[idx]) if code != NO_SEAT]
+        scalar_status = None
+        room.check_result()
+        if room.started:
+            scalar_outcome = ONGOING
+            scalar_status = [STATUS_CODES[room.players[f'p{seat}'].status]
+                             for seat, code in enumerate(games.roles[idx]) if code != NO_SEAT]
+        elif any(text == 'game over, Wolfman wins.' for _, text in room.log):
+            scalar_outcome = WOLF_WIN
+        else:
+            scalar_outcome = GOOD_WIN
+
+        seats = games.roles[idx] != NO_SEAT
+        if scalar_pending != pending[idx][seats].tolist() or scalar_outcome != outcome[idx] or \
+                (scalar_status is not None and scalar_status != status[idx][seats].tolist()):
+            mismatched.append(int(idx))
+    return mismatched
@@ -0,0 +1,54 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, List, Set, Dict, Deque, Tuple, TYPE_CHECKING
+
+from enums import GameStage
+from models.system import Config
+
+if TYPE_CHECKING:
+    from .room import Room
+
+
+@dataclass
+class ChatChannel:
+    name: str
+    # Stages of a running game in which members may speak, None stands for the pauses between stages
+    stages: List[Optional[GameStage]]
+    lobby: bool  # Members may speak while no game is running
+    members: Set[str]  # Nicks allowed to read and speak, maintained by Room.refresh_chat
+    history: Deque[Tuple[str, str]]  # (nick, text), bounded by Config.CHAT_HISTORY
+    sent: Dict[str, Deque[float]]  # Recent send times per nick, for rate limiting
+
+    @classmethod
+    def alloc(cls, name: str, stages: List[Optional[GameStage]], lobby: bool) -> 'ChatChannel':
+        return cls(name=name, stages=stages, lobby=lobby, members=set(),
+                   history=deque(maxlen=Config.CHAT_HISTORY), sent=dict())
+
+    def can_speak(self, room: 'Room', nick: str) -> bool:
+        if nick not in self.members:
+            return False
+        if not room.started:
+            return self.lobby
+        return room.stage in self.stages
+
+    def post(self, room: 'Room', nick: str, text: str) -> Optional[str]:
+        """Deliver a message to every member, return an error message on failure"""
+        if not self.can_speak(room, nick):
+            return 'You cannot speak in this channel now'
+
+        now = time.monotonic()
+        limit, window = Config.CHAT_RATE_LIMIT
+        sent = self.sent.setdefault(nick, deque(maxlen=limit))
+        if len(sent) == limit and now - sent[0] < window:
+            return 'You are sending messages too fast'
+        sent.append(now)
+
+        self.deliver(room, nick, text)
+
+    def deliver(self, room: 'Room', nick: str, text: str):
+        """Push a message to every member, without speaking checks"""
+        self.history.append((nick, text))
+        line = f'💬[{self.name}] {nick}: {text}'
+        for member in self.members:
+            room.players[member].chat_inbox.append(line)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import Optional, List, Dict, TYPE_CHECKING
+
+from models.memory import enforce_room_caps
+from models.system import Global, Config
+from utils import log_drop_count
+from . import logger
+
+if TYPE_CHECKING:
+    from .room import Room
+
+
+class Lifecycle:
+    """Room reaper, closes idle or abandoned rooms and reports tasks that outlived their room"""
+    reaper: Optional[asyncio.Future] = None
+    drainer: Optional[asyncio.Future] = None
+    leaking: List['Room'] = []
+    log_dropped: int = 0  # Drop count at the last reap
+
+    @classmethod
+    def start_reaper(cls):
+        """Start the reaper on the server event loop, it is not bound to any user session"""
+        if cls.reaper is None or cls.reaper.done():
+            cls.reaper = asyncio.ensure_future(cls._reaper_loop())
+
+    @classmethod
+    async def _reaper_loop(cls):
+        while True:
+            await asyncio.sleep(Config.REAPER_INTERVAL)
+            try:
+                cls.reap()
+            except Exception:
+                logger.exception('Room reaper failed')
+
+    @classmethod
+    def reap(cls, now: Optional[float] = None) -> List[int]:
+        """Close every idle room or room over its memory cap, return the closed room ids"""
+        now = time.monotonic() if now is None else now
+        reaped = []
+        for room in list(Global.rooms.values()):
+            if room.is_idle(now):
+                room.close('room idle for too long')
+                reaped.append(room.id)
+
+        reaped.extend(enforce_room_caps())
+
+        leaked = cls.task_report()
+        if reaped or leaked:
+            logger.info(f'Reaped rooms {reaped}, {len(Global.rooms)} rooms alive, leaked tasks {leaked}')
+
+        dropped = log_drop_count()
+        if dropped != cls.log_dropped:
+            logger.warning(f'Dropped {dropped - cls.log_dropped} log records, {dropped} in total')
+            cls.log_dropped = dropped
+        return reaped
+
+    @classmethod
+    def track_leaks(cls, room: 'Room'):
+        """Keep watching a closed room whose tasks did not stop"""
+        cls.leaking.append(room)
+
+    @classmethod
+    def task_report(cls) -> Dict[int, int]:
+        """Number of tasks still running per closed room"""
+        cls.leaking = [room for room in cls.leaking if room.list_leaked_tasks()]
+        return {room.id: len(room.list_leaked_tasks()) for room in cls.leaking}
+
+    @classmethod
+    def start_drain(cls, timeout: Optional[float] = None):
+        """
+        Stop accepting rooms and games, exit once the running games are over or the timeout is hit
+
+        New sessions are sent to Config.HANDOFF_URL meanwhile
+        """
+        if Global.draining:
+            return
+        Global.draining = True
+        deadline = time.monotonic() + (Config.DRAIN_TIMEOUT if timeout is None else timeout)
+        for room in list(Global.rooms.values()):
+            room.broadcast_msg('The server is restarting, no new game will start after the current one')
+        logger.info(f'Draining {len(Global.rooms)} rooms')
+        cls.drainer = asyncio.ensure_future(cls._drain_loop(deadline))
+
+    @classmethod
+    async def _drain_loop(cls, deadline: float):
+        from tornado.ioloop import IOLoop
+
+        while Global.rooms and time.monotonic() < deadline:
+            for room in list(Global.rooms.values()):
+                if not room.started:
+                    room.close('server restarting')
+            await asyncio.sleep(1)
+
+        for room in list(Global.rooms.values()):
+            room.close('server restart deadline reached')
+        logger.info('Drained, stopping the server')
+        IOLoop.current().stop()
@@ -0,0 +1,142 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Dict, Deque, List, Tuple
+
+from models.room import Room
+from models.system import Config, Global
+from models.user import User
+from . import logger
+
+
+@dataclass
+class Ticket:
+    """A player waiting in the matchmaking queue"""
+    user: User
+    preset: str  # Key of Config.ROOM_PRESETS
+    enqueued_at: float  # time.monotonic()
+    room: Optional[Room]  # Set by the matchmaker, the player session joins it
+    widened: bool  # Waited long enough to accept any preset
+    cancelled: bool
+    claimed: bool  # The player session took its seat in the room, see Matchmaker.claim
+
+
+class Matchmaker:
+    """
+    Pack waiting players into rooms
+
+    Tickets are queued per preset, a ticket that waited longer than Config.MATCH_WIDEN_AFTER
+    moves to the widened queue and can fill a room of any preset.
+    Cancelled tickets stay in the queues and are skipped when popped, the live counters exclude them.
+    Matched rooms hold a reserved seat per ticket until its session claims it, seats that are abandoned
+    before the game starts are refilled from the same queues.
+    """
+    queues: Dict[str, Deque[Ticket]] = {preset: deque() for preset in Config.ROOM_PRESETS}
+    counts: Dict[str, int] = {preset: 0 for preset in Config.ROOM_PRESETS}
+    widened: Deque[Ticket] = deque()
+    widened_count = 0
+    filling: List[Tuple[Room, str]] = []  # Matched rooms that did not start yet, with their preset
+
+    @classmethod
+    def presets(cls) -> list:
+        return list(Config.ROOM_PRESETS.keys())
+
+    @classmethod
+    def enqueue(cls, user: User, preset: str) -> Ticket:
+        if preset not in cls.queues:
+            raise ValueError(preset)
+        ticket = Ticket(
+            user=user,
+            preset=preset,
+            enqueued_at=time.monotonic(),
+            room=None,
+            widened=False,
+            cancelled=False,
+            claimed=False,
+        )
+        cls.queues[preset].append(ticket)
+        cls.counts[preset] += 1
+        return ticket
+
+    @classmethod
+    def cancel(cls, ticket: Ticket):
+        """Leave the queue, or give the reserved seat back if the ticket was matched but not claimed"""
+        if ticket.cancelled or ticket.claimed:
+            return
+        ticket.cancelled = True
+        if ticket.room is not None:
+            ticket.room.reserved -= 1
+            return
+        if ticket.widened:
+            cls.widened_count -= 1
+        else:
+            cls.counts[ticket.preset] -= 1
+
+    @classmethod
+    def claim(cls, ticket: Ticket) -> Optional[Room]:
+        """Turn the reserved seat of a matched ticket into a player seat, None if the room is gone"""
+        ticket.claimed = True
+        ticket.room.reserved -= 1
+        if ticket.room.closed:
+            return None
+        return ticket.room
+
+    @classmethod
+    def _widen(cls, now: float):
+        deadline = now - Config.MATCH_WIDEN_AFTER
+        for preset, queue in cls.queues.items():
+            while queue and queue[0].enqueued_at < deadline:
+                ticket = queue.popleft()
+                if ticket.cancelled:
+                    continue
+                cls.counts[preset] -= 1
+                ticket.widened = True
+                cls.widened.append(ticket)
+                cls.widened_count += 1
+
+    @classmethod
+    def _available(cls, preset: str) -> int:
+        return cls.counts[preset] + cls.widened_count
+
+    @classmethod
+    def _pop(cls, preset: str) -> Ticket:
+        """Pop the oldest live ticket of the preset, falling back to widened tickets"""
+        queue = cls.queues[preset]
+        while queue:
+            ticket = queue.popleft()
+            if not ticket.cancelled:
+                cls.counts[preset] -= 1
+                return ticket
+        while True:
+            ticket = cls.widened.popleft()
+            if not ticket.cancelled:
+                cls.widened_count -= 1
+                return ticket
+
+    @classmethod
+    def match(cls, now: Optional[float] = None) -> List[Room]:
+        """Allocate a room for every preset that has enough waiting players"""
+        if Global.draining:
+            return []
+        cls._widen(time.monotonic() if now is None else now)
+
+        # Refill the seats abandoned in matched rooms first
+        cls.filling = [(room, preset) for room, preset in cls.filling if not room.started and not room.closed]
+        for room, preset in cls.filling:
+            vacancies = len(room.roles) - len(room.players) - room.reserved
+            for _ in range(min(vacancies, cls._available(preset))):
+                cls._pop(preset).room = room
+                room.reserved += 1
+
+        rooms = []
+        for preset, setting in Config.ROOM_PRESETS.items():
+            size = Room.setting_size(setting)
+            while cls._available(preset) >= size:
+                room = Room.alloc(setting, auto_start=True)
+                for _ in range(size):
+                    cls._pop(preset).room = room
+                room.reserved = size
+                cls.filling.append((room, preset))
+                rooms.append(room)
+                logger.info(f'Matched room "{room.id}" with preset "{preset}"', extra={'room': room.id})
+        return rooms
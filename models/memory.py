@@ -0,0 +1,108 @@
+import sys
+import tracemalloc
+from collections import deque
+from typing import Optional, List, TYPE_CHECKING
+
+from models.system import Global, Config
+from . import logger
+
+if TYPE_CHECKING:
+    from .room import Room
+    from .user import User
+
+_CONTAINERS = (list, tuple, set, frozenset, deque)
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """Approximate retained size of plain data: containers, dicts and their items, each object counted once"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, _CONTAINERS):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def session_footprint(user: 'User') -> dict:
+    """Approximate bytes retained by a player session, the output handler is counted shallow"""
+    usage = dict(
+        game_msg=sys.getsizeof(user.game_msg),
+        chat_inbox=deep_sizeof(user.chat_inbox),
+        skill=deep_sizeof(user.skill),
+    )
+    usage['total'] = sum(usage.values())
+    return usage
+
+
+def room_footprint(room: 'Room') -> dict:
+    """
+    Approximate bytes retained by a room: log, chat, players and tasks
+
+    The log is accounted incrementally by the room, everything else walked here is bounded in size
+    """
+    seen = set()
+    usage = dict(
+        log=sys.getsizeof(room.log) + room.log_bytes,
+        chat=sum(deep_sizeof(channel.history, seen) + deep_sizeof(channel.sent, seen)
+                 for channel in room.chat.values()),
+        widgets=deep_sizeof(room.widget_cache, seen),
+        players=sum(session_footprint(user)['total'] for user in room.players.values()),
+        tasks=sum(sys.getsizeof(task) for task in room.tasks),
+    )
+    usage['total'] = sum(usage.values())
+    usage['log_entries'] = len(room.log)
+    usage['task_count'] = len(room.tasks)
+    return usage
+
+
+def memory_report() -> dict:
+    """Footprint of every room, by room id"""
+    return {room.id: room_footprint(room) for room in list(Global.rooms.values())}
+
+
+def enforce_room_caps() -> List[int]:
+    """Compact the log of rooms over Config.ROOM_MEMORY_CAP, close them if that is not enough"""
+    if Config.ROOM_MEMORY_CAP is None:
+        return []
+    closed = []
+    for room in list(Global.rooms.values()):
+        if room_footprint(room)['total'] <= Config.ROOM_MEMORY_CAP:
+            continue
+        room.compact_log(Config.ROOM_LOG_KEEP)
+        size = room_footprint(room)['total']
+        logger.warning(f'Room "{room.id}" over memory cap, log compacted to {size} bytes', extra={'room': room.id})
+        if size > Config.ROOM_MEMORY_CAP:
+            room.close('memory cap exceeded')
+            closed.append(room.id)
+    return closed
+
+
+class Tracemalloc:
+    """On demand tracemalloc snapshots, each diff is against the previous snapshot"""
+    last: Optional[tracemalloc.Snapshot] = None
+
+    @classmethod
+    def snapshot_diff(cls, limit=20) -> List[str]:
+        """Take a snapshot, return the top allocation changes since the last one"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(Config.TRACEMALLOC_FRAMES)
+            logger.info('tracemalloc started')
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        if cls.last is None:
+            stats = snapshot.statistics('lineno')[:limit]
+        else:
+            stats = snapshot.compare_to(cls.last, 'lineno')[:limit]
+        cls.last = snapshot
+        return [str(stat) for stat in stats]
+
+    @classmethod
+    def stop(cls):
+        cls.last = None
+        tracemalloc.stop()
@@ -1,17 +1,20 @@
 import asyncio
 import random
+import sys
+import time
 from collections import Counter
 from copy import copy
 from dataclasses import dataclass
-from typing import Optional, List, Dict, Tuple, Union
+from typing import Optional, List, Dict, Tuple, Union, Callable
 
-from pywebio import run_async
 from pywebio.session.coroutinebased import TaskHandle
 
-from enums import Role, WitchRule, GuardRule, GameStage, LogCtrl, PlayerStatus
+from enums import Role, WitchRule, GuardRule, NightRule, WolfVoteRule, GameStage, LogCtrl, PlayerStatus
+from models.chat import ChatChannel
+from models.lifecycle import Lifecycle
 from models.system import Global, Config
-from models.user import User
-from utils import say
+from models.user import User, STAGE_ROLES
+from utils import say, add_cancel_button, input_spec
 from . import logger
 
 
@@ -23,6 +26,12 @@ class Room:
     roles: List[Role]
     witch_rule: WitchRule
     guard_rule: GuardRule
+    night_rule: NightRule
+    wolf_vote_rule: WolfVoteRule
+    auto_start: bool  # Filled by the matchmaker, the game starts once the room is full
+    reserved: int  # Seats held for matched players that did not join yet
+    seed: int  # Recorded seed of self.rng
+    rng: random.Random  # Source of all randomness in the room
 
     # Dynamic
     started: bool  # Game start state
@@ -31,62 +40,173 @@ class Room:
     players: Dict[str, User]  # Players in the room
     round: int  # round
     stage: Optional[GameStage]  # Game stage
+    parallel_stages: List[GameStage]  # Stages still acting in a concurrent night phase
     waiting: bool  # Waiting for player action
+    wolf_votes: Dict[str, Optional[str]]  # Wolf nick -> target nick, None for no kill
+    wolf_tally: Counter  # Target nick -> votes, updated with every vote
+    alive_version: int  # Bumped whenever a player dies or leaves
+    widget_cache: Dict[tuple, list]  # Room.stage_buttons and Room.stage_inputs cache
+    chat: Dict[str, ChatChannel]  # Chat channels by name
     # broadcast message source, (target, content)
     log: List[Tuple[Union[str, None], Union[str, LogCtrl]]]
+    log_base: int  # Number of entries dropped from the head of log by compaction
+    log_bytes: int  # Running approximate size of the log entries, see Room.append_log
 
     # Internal
-    logic_thread: Optional[TaskHandle]
-
-    async def night_logic(self):
-        """Single Night Logic"""
+    logic_thread: Optional[asyncio.Future]
+    # Every task spawned on behalf of the room (see Room.spawn) and the player syncers handed over on close
+    tasks: List[Union[asyncio.Future, TaskHandle]]
+    created_at: float  # time.monotonic() at allocation
+    last_active: float  # time.monotonic() of the latest room activity
+    closed: bool  # Room has been torn down and unregistered
+
+    async def night_logic(self, delay: float = 0):
+        """Single Night Logic, delay gives the players time to read their identity on the first night"""
+        await asyncio.sleep(delay)
         # start
         self.round += 1
+        self.wolf_votes.clear()
+        self.wolf_tally.clear()
+        self.broadcast_log_ctrl(LogCtrl.RemoveInput)
         self.broadcast_msg("Please close your eyes when it's dark", tts=True)
         await asyncio.sleep(3)
 
-        # werewolf
-        self.stage = GameStage.WOLF
-        self.broadcast_msg('Werewolf please appear', tts=True)
-        await self.wait_for_player()
-        self.broadcast_msg('Wolfman please close your eyes', tts=True)
-        await asyncio.sleep(3)
-
-        # Prophet
-        if Role.DETECTIVE in self.roles:
-            self.stage = GameStage.DETECTIVE
-            self.broadcast_msg('The prophet please appear', tts=True)
+        if self.night_rule == NightRule.CONCURRENT:
+            # werewolf, prophet and guard don't depend on each other
+            stages = [GameStage.WOLF]
+            if Role.DETECTIVE in self.roles:
+                stages.append(GameStage.DETECTIVE)
+            if Role.GUARD in self.roles:
+                stages.append(GameStage.GUARD)
+            self.stage = GameStage.WOLF
+            self.parallel_stages = stages
+            self.broadcast_log_ctrl(LogCtrl.RemoveInput)
+            self.broadcast_msg(f'{", ".join(stage.value for stage in stages)} please appear', tts=True)
             await self.wait_for_player()
-            self.broadcast_msg('The prophet, please close your eyes', tts=True)
+            self.broadcast_msg(f'{", ".join(stage.value for stage in stages)} please close your eyes', tts=True)
             await asyncio.sleep(3)
+        else:
+            # werewolf
+            await self.run_stage(GameStage.WOLF, 'Werewolf please appear', 'Wolfman please close your eyes')
+
+            # Prophet
+            if Role.DETECTIVE in self.roles:
+                await self.run_stage(GameStage.DETECTIVE, 'The prophet please appear',
+                                     'The prophet, please close your eyes')
 
         # witch
         if Role.WITCH in self.roles:
-            self.stage = GameStage.WITCH
-            self.broadcast_msg('Witch please appear', tts=True)
-            await self.wait_for_player()
-            self.broadcast_msg('Witch please close your eyes', tts=True)
-            await asyncio.sleep(3)
+            await self.run_stage(GameStage.WITCH, 'Witch please appear', 'Witch please close your eyes')
 
         # guard
-        if Role.GUARD in self.roles:
-            self.stage = GameStage.GUARD
-            self.broadcast_msg('Guards please appear', tts=True)
-            await self.wait_for_player()
-            self.broadcast_msg('Guard, please close your eyes', tts=True)
-            await asyncio.sleep(3)
+        if self.night_rule == NightRule.CONCURRENT:
+            # The guard chose during the wolf phase, the protection still resolves after the witch
+            self.apply_deferred_guard()
+        elif Role.GUARD in self.roles:
+            await self.run_stage(GameStage.GUARD, 'Guards please appear', 'Guard, please close your eyes')
 
         # hunter
         if Role.HUNTER in self.roles:
-            self.stage = GameStage.HUNTER
-            self.broadcast_msg('Hunter please appear', tts=True)
-            await self.wait_for_player()
-            self.broadcast_msg('Hunter please close your eyes', tts=True)
-            await asyncio.sleep(3)
+            await self.run_stage(GameStage.HUNTER, 'Hunter please appear', 'Hunter please close your eyes')
 
         # test result
         self.check_result()
 
+    async def run_stage(self, stage: GameStage, appear_text: str, close_text: str):
+        """Wake up the players of a stage and wait for their action"""
+        self.stage = stage
+        self.broadcast_log_ctrl(LogCtrl.RemoveInput)
+        self.broadcast_msg(appear_text, tts=True)
+        await self.wait_for_player()
+        self.broadcast_msg(close_text, tts=True)
+        await asyncio.sleep(3)
+
+    def current_stages(self) -> List[GameStage]:
+        """Stages whose players may act right now"""
+        if self.parallel_stages:
+            return self.parallel_stages
+        return [self.stage] if self.stage else []
+
+    def finish_stage(self, stage: GameStage):
+        """Unlock a stage, the night goes on once every stage of a concurrent phase is done"""
+        if stage in self.parallel_stages:
+            self.parallel_stages.remove(stage)
+            if self.parallel_stages:
+                return
+        self.waiting = False
+        self.enter_null_stage()
+
+    # Wolf consensus
+    def wolf_vote(self, voter: 'User', target: Optional[str]) -> bool:
+        """Record or change a wolf vote, return True once the pack decided and the kill is applied"""
+        self.drop_wolf_vote(voter.nick)
+        self.wolf_votes[voter.nick] = target
+        self.wolf_tally[target] += 1
+
+        tally = ', '.join(f'{nick or "no kill"}: {count}' for nick, count in self.wolf_tally.items() if count)
+        self.chat['wolf'].deliver(self, Config.SYS_NICK, f'{voter.nick} votes {target or "no kill"} ({tally})')
+
+        decided, target = self.wolf_decision()
+        if decided:
+            self.resolve_wolf_kill(target)
+        return decided
+
+    def drop_wolf_vote(self, voter: str):
+        """Take back a wolf vote, targets left without votes leave the tally"""
+        if voter not in self.wolf_votes:
+            return
+        target = self.wolf_votes.pop(voter)
+        self.wolf_tally[target] -= 1
+        if not self.wolf_tally[target]:
+            del self.wolf_tally[target]
+
+    def withdraw_wolf_votes(self, nick: str):
+        """Drop the votes of and for a departed player, the remaining voters may already agree"""
+        for voter in [voter for voter, target in self.wolf_votes.items() if nick in (voter, target)]:
+            self.drop_wolf_vote(voter)
+        if GameStage.WOLF not in self.current_stages():
+            return
+        decided, target = self.wolf_decision()
+        if decided:
+            self.resolve_wolf_kill(target)
+            self.finish_stage(GameStage.WOLF)
+
+    def wolf_decision(self, final=False) -> Tuple[bool, Optional[str]]:
+        """(decided, target) according to the wolf vote rule, `final` picks the plurality target, no kill on a tie"""
+        if not self.wolf_tally:
+            return final, None
+        (target, count), *rest = self.wolf_tally.most_common(2)
+        voters = len(self.list_wolf_voters())
+        if self.wolf_vote_rule == WolfVoteRule.MAJORITY and count * 2 > voters:
+            return True, target
+        if self.wolf_vote_rule == WolfVoteRule.UNANIMOUS and count == voters:
+            return True, target
+        if final:
+            return True, None if rest and rest[0][1] == count else target
+        return False, None
+
+    def list_wolf_voters(self) -> list:
+        """Wolves allowed to vote on the night kill"""
+        return [user for user in self.players.values()
+                if user.role in [Role.WOLF, Role.WOLF_KING] and user.status != PlayerStatus.DEAD]
+
+    def resolve_wolf_kill(self, target: Optional[str]):
+        if target is not None:
+            self.players[target].status = PlayerStatus.PENDING_DEAD
+        self.chat['wolf'].deliver(self, Config.SYS_NICK, f'The pack chose: {target or "no kill"}')
+
+    def close_wolf_vote(self):
+        """Voting time is over, resolve with the votes cast so far"""
+        _, target = self.wolf_decision(final=True)
+        self.resolve_wolf_kill(target)
+        self.finish_stage(GameStage.WOLF)
+
+    def apply_deferred_guard(self):
+        """Apply the protection chosen by the guard in a concurrent phase"""
+        for user in self.players.values():
+            if user.role == Role.GUARD and user.skill.get('protect') is not None:
+                user.protect(user.skill.pop('protect'))
+
     def check_result(self, is_vote_check=False):
         """Check results, called after voting and at the end of the night"""
         out_result = []  # This game is out
@@ -113,6 +233,8 @@ class Room:
             if user.status in [PlayerStatus.PENDING_DEAD, PlayerStatus.PENDING_POISON]:
                 self.players[nick].status = PlayerStatus.DEAD
                 out_result.append(nick)
+        if out_result:
+            self.players_changed()
 
         if not citizen_team or (not self.is_no_god() and not god_team):
             self.stop_game('Wolfman wins')
@@ -124,6 +246,7 @@ class Room:
 
         if not is_vote_check:
             self.stage = GameStage.Day
+            self.broadcast_log_ctrl(LogCtrl.RemoveInput)
             self.broadcast_msg(
                 f'it was dawn, last night {"no one" if not out_result else ",".join(out_result)} out', tts=True)
             self.broadcast_msg('waiting to vote')
@@ -131,6 +254,7 @@ class Room:
 
     async def vote_kill(self, nick):
         self.players[nick].status = PlayerStatus.DEAD
+        self.players_changed()
         self.check_result(is_vote_check=True)
         if self.started:
             self.enter_null_stage()
@@ -139,12 +263,29 @@ class Room:
     async def wait_for_player(self):
         """Player operation waiting for lock"""
         self.waiting = True
+        wolf_deadline = None
+        if GameStage.WOLF in self.current_stages() and self.wolf_vote_rule != WolfVoteRule.FIRST:
+            wolf_deadline = time.monotonic() + Config.WOLF_VOTE_TIMEOUT
         while True:
             await asyncio.sleep(0.1)
+            self.release_vacant_stages()
+            if wolf_deadline is not None and time.monotonic() > wolf_deadline:
+                wolf_deadline = None
+                if GameStage.WOLF in self.current_stages():
+                    self.close_wolf_vote()
             if self.waiting is False:
                 self.broadcast_log_ctrl(LogCtrl.RemoveInput)
                 break
 
+    def release_vacant_stages(self):
+        """Finish the current stages whose role is no longer held by anyone in the room, e.g. after leaving"""
+        if not self.waiting:
+            return
+        held = {user.role for user in self.players.values()}
+        for stage in list(self.current_stages()):
+            if not held.intersection(STAGE_ROLES[stage]):
+                self.finish_stage(stage)
+
     def enter_null_stage(self):
         """
         Set the current game stage to None
@@ -152,12 +293,17 @@ class Room:
         Make sure to call this function "at the end of each phase logic" to keep the client UI state correct
         """
         self.stage = None
+        self.parallel_stages = []
 
     async def start_game(self):
         """Start game/next night"""
         if not self.started:
-            if self.logic_thread is not None and not self.logic_thread.closed():
-                logger.error('The last game was not closed properly')
+            if Global.draining:
+                self.broadcast_msg('The server is restarting, no new game can be started')
+                return
+
+            if self.logic_thread is not None and not self.logic_thread.done():
+                logger.error('The last game was not closed properly', extra={'room': self.id})
                 return
 
             if len(self.players) != len(self.roles):
@@ -170,7 +316,7 @@ class Room:
             # assign identity
             self.broadcast_msg(
                 'The game starts, please check your identity', tts=True)
-            random.shuffle(self.roles_pool)
+            self.rng.shuffle(self.roles_pool)
             for nick in self.players:
                 self.players[nick].role = self.roles_pool.pop()
                 self.players[nick].status = PlayerStatus.ALIVE
@@ -183,13 +329,17 @@ class Room:
                     self.players[nick].skill['last_protect'] = None
                 self.players[nick].send_msg(
                     f'Your identity is "{self.players[nick].role}"')
+            self.players_changed()
 
-            await asyncio.sleep(5)
+            # Waited in the room task too, the caller's session may be gone by then
+            self.logic_thread = self.spawn(self.night_logic(delay=5))
+            return
 
-        self.logic_thread = run_async(self.night_logic())
+        self.logic_thread = self.spawn(self.night_logic())
 
     def stop_game(self, reason=''):
         """End Game"""
+        self._close_task(self.logic_thread)
         self.started = False
         self.roles_pool = copy(self.roles)
         self.round = 0
@@ -201,17 +351,80 @@ class Room:
             self.broadcast_msg(f'{nick}:{user.role}({user.status})')
             self.players[nick].role = None
             self.players[nick].status = None
+        self.players_changed()
 
     def list_alive_players(self) -> list:
         """Return surviving users, including players in PENDING_DEAD state"""
         return [user for user in self.players.values() if user.status != PlayerStatus.DEAD]
 
+    def stage_buttons(self, stage: GameStage) -> list:
+        """
+        Player choice buttons of a stage, shared by every session prompted in it
+
+        Cached per (stage, round, alive set version), see Room.players_changed
+        """
+        key = (stage, self.round, self.alive_version)
+        if key not in self.widget_cache:
+            buttons = [dict(label=user.nick, value=user.nick, type='submit') for user in self.list_alive_players()]
+            if stage in [GameStage.WOLF, GameStage.WITCH, GameStage.GUARD]:
+                buttons = add_cancel_button(buttons)
+            # Entries of past rounds are never hit again
+            self.widget_cache = {k: v for k, v in self.widget_cache.items() if k[-2:] == key[-2:]}
+            self.widget_cache[key] = buttons
+        return self.widget_cache[key]
+
+    def stage_inputs(self, stage: GameStage, build: Callable[[list], list]) -> list:
+        """
+        Form inputs of a stage built from its buttons, shared by every session prompted in it
+
+        Cached like Room.stage_buttons, the inputs are unwrapped with utils.input_spec so they can be reused
+        """
+        key = ('inputs', stage, self.round, self.alive_version)
+        if key not in self.widget_cache:
+            buttons = self.stage_buttons(stage)
+            self.widget_cache[key] = [input_spec(item) for item in build(buttons)]
+        return self.widget_cache[key]
+
+    def players_changed(self):
+        """A player joined, left, died or got a role: drop the cached stage buttons and rebuild chat membership"""
+        self.alive_version += 1
+        self.widget_cache.clear()
+        self.refresh_chat()
+
+    # Chat
+    def refresh_chat(self):
+        """Rebuild the member index of every chat channel"""
+        alive, wolves, dead = set(), set(), set()
+        for nick, user in self.players.items():
+            if user.status == PlayerStatus.DEAD:
+                dead.add(nick)
+                continue
+            alive.add(nick)
+            if user.role in [Role.WOLF, Role.WOLF_KING]:
+                wolves.add(nick)
+        self.chat['all'].members = alive
+        self.chat['wolf'].members = wolves
+        self.chat['dead'].members = dead
+
+    def chat_channel_for(self, user: 'User') -> Optional[ChatChannel]:
+        """The channel the user may speak in right now"""
+        for channel in self.chat.values():
+            if channel.can_speak(self, user.nick):
+                return channel
+        return None
+
     def list_pending_kill_players(self) -> list:
         return [user for user in self.players.values() if user.status == PlayerStatus.PENDING_DEAD]
 
     def is_full(self) -> bool:
         return len(self.players) >= len(self.roles)
 
+    @staticmethod
+    def setting_size(room_setting) -> int:
+        """Number of players required by a room setting"""
+        return room_setting['wolf_num'] + room_setting['citizen_num'] + \
+            len(room_setting['god_wolf']) + len(room_setting['god_citizen'])
+
     def is_no_god(self):
         """The room is not equipped with a god"""
         god_roles = [Role.DETECTIVE, Role.WITCH, Role.HUNTER, Role.GUARD]
@@ -227,11 +440,13 @@ class Room:
         self.players[user.nick] = user
         user.room = self
         user.start_syncer()  # will run later
+        self.touch()
 
+        self.players_changed()
         players_status = f'Number of people {len(self.players)}/{len(self.roles)}, the host is {self.get_host()}'
         user.game_msg.append(players_status)
         self.broadcast_msg(players_status)
-        logger.info(f'User "{user.nick}" joins room "{self.id}"')
+        logger.info(f'User "{user.nick}" joins room "{self.id}"', extra={'room': self.id, 'user': user.nick})
 
     def remove_player(self, user: 'User'):
         """Remove user from room"""
@@ -240,14 +455,21 @@ class Room:
         self.players.pop(user.nick)
         user.stop_syncer()
         user.room = None
+        self.players_changed()
 
         if not self.players:
-            Global.remove_room(self.id)
+            self.close('all players left')
             return
 
+        if self.started:
+            # The departed player is out, check_result decides whether the game goes on
+            user.status = PlayerStatus.DEAD
+            self.withdraw_wolf_votes(user.nick)
+            self.release_vacant_stages()
+
         self.broadcast_msg(
             f'Number of people {len(self.players)}/{len(self.roles)}, the host is {self.get_host()}')
-        logger.info(f'User "{user.nick}" left room "{self.id}"')
+        logger.info(f'User "{user.nick}" left room "{self.id}"', extra={'room': self.id, 'user': user.nick})
 
     def get_host(self):
         if not self.players:
@@ -256,27 +478,133 @@ class Room:
 
     def send_msg(self, text: str, nick: str):
         """Send a message to the specified player, visible only to the specified player"""
-        self.log.append((nick, text))
+        self.append_log((nick, text))
+        self.touch()
+        logger.debug(f'To {nick}: {text}', extra={'room': self.id, 'user': nick})
 
     def broadcast_msg(self, text: str, tts=False):
         """Broadcast a message to all players in the room"""
         if tts:
             say(text)
 
-        self.log.append((Config.SYS_NICK, text))
+        self.append_log((Config.SYS_NICK, text))
+        self.touch()
+        logger.debug(f'Broadcast: {text}', extra={'room': self.id})
 
     def broadcast_log_ctrl(self, ctrl_type: LogCtrl):
         """Broadcast special client control messages"""
-        self.log.append((None, ctrl_type))
+        self.append_log((None, ctrl_type))
+
+    @staticmethod
+    def log_entry_size(entry: tuple) -> int:
+        """Approximate bytes of a log entry, nicks and control enums are shared and not counted"""
+        size = sys.getsizeof(entry)
+        if isinstance(entry[1], str):
+            size += sys.getsizeof(entry[1])
+        return size
+
+    def append_log(self, entry: tuple):
+        self.log.append(entry)
+        self.log_bytes += self.log_entry_size(entry)
+
+    def compact_log(self, keep: int):
+        """Drop all but the latest `keep` log entries"""
+        dropped = max(len(self.log) - keep, 0)
+        if dropped:
+            self.log_bytes -= sum(self.log_entry_size(entry) for entry in self.log[:dropped])
+            self.log = self.log[dropped:]
+            self.log_base += dropped
+
+    # Lifecycle
+    def spawn(self, coro) -> asyncio.Future:
+        """
+        Run a coroutine owned by the room, it will be closed together with the room
+
+        The task runs on the server event loop rather than in the calling session,
+        so it keeps going when the player who started it leaves
+        """
+        self.tasks = [task for task in self.tasks if not self._task_done(task)]
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(self._log_task_error)
+        self.tasks.append(task)
+        return task
+
+    def _log_task_error(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Room task failed', exc_info=task.exception(), extra={'room': self.id})
+
+    @staticmethod
+    def _task_done(task: Union[asyncio.Future, TaskHandle]) -> bool:
+        return task.done() if isinstance(task, asyncio.Future) else task.closed()
+
+    @classmethod
+    def _close_task(cls, task: Union[asyncio.Future, TaskHandle, None]):
+        if task is None or cls._task_done(task):
+            return
+        if isinstance(task, asyncio.Future):
+            # Also fine from inside the task itself (e.g. night_logic -> check_result -> stop_game),
+            # it is cancelled at its next await
+            task.cancel()
+            return
+        try:
+            task.close()
+        except ValueError:
+            # Closing a session task from inside itself, the coroutine returns on its own right after
+            pass
+
+    def touch(self):
+        """Mark the room as active, see Room.is_idle"""
+        self.last_active = time.monotonic()
+
+    def is_idle(self, now: float) -> bool:
+        """Room has no players or saw no activity for longer than the configured TTL"""
+        if not self.players:
+            # Leave matched players some time to take their seats
+            return now - self.created_at > Config.MATCH_JOIN_GRACE
+        ttl = Config.ROOM_GAME_IDLE_TTL if self.started else Config.ROOM_IDLE_TTL
+        return now - self.last_active > ttl
+
+    def list_leaked_tasks(self) -> List[Union[asyncio.Future, TaskHandle]]:
+        """Room-owned tasks that are still running, should be empty once the room is closed"""
+        return [task for task in self.tasks if not self._task_done(task)]
+
+    def close(self, reason=''):
+        """Tear the room down: stop the game, close every room-owned task and unregister it"""
+        if self.closed:
+            return
+        if self.started:
+            self.stop_game(reason)
+        for user in list(self.players.values()):
+            self.players.pop(user.nick)
+            if user.game_msg_syncer is not None:
+                self.tasks.append(user.game_msg_syncer)
+                user.game_msg_syncer = None
+            user.room = None
+        for task in self.tasks:
+            self._close_task(task)
+        self.closed = True
+        Global.remove_room(self.id)
+
+        if self.list_leaked_tasks():
+            # Cancelled room tasks only stop at their next await, the reaper reports the ones that don't
+            Lifecycle.track_leaks(self)
+        logger.info(f'Room "{self.id}" closed: {reason}', extra={'room': self.id})
 
     def desc(self):
         return f'room number {self.id},' \
                f' requires players {len(self.roles)} people,' \
-               f'staffing: {dict(Counter(self.roles))}'
+               f'staffing: {dict(Counter(self.roles))},' \
+               f' seed {self.seed}'
 
     @classmethod
-    def alloc(cls, room_setting) -> 'Room':
-        """Create room by setting and register it to global storage"""
+    def alloc(cls, room_setting, auto_start=False) -> 'Room':
+        """
+        Create room by setting and register it to global storage
+
+        room_setting may carry a 'seed' to replay a recorded room, drawn from Global.rng otherwise
+        """
+        if Global.draining:
+            raise AssertionError('The server is restarting')
         # build full role list
         roles = []
         roles.extend([Role.WOLF] * room_setting['wolf_num'])
@@ -284,6 +612,10 @@ class Room:
         roles.extend(Role.from_option(room_setting['god_wolf']))
         roles.extend(Role.from_option(room_setting['god_citizen']))
 
+        seed = room_setting.get('seed')
+        if seed is None:
+            seed = Global.rng.getrandbits(32)
+
         # Go
         return Global.reg_room(
             cls(
@@ -292,16 +624,39 @@ class Room:
                 roles=copy(roles),
                 witch_rule=WitchRule.from_option(room_setting['witch_rule']),
                 guard_rule=GuardRule.from_option(room_setting['guard_rule']),
+                night_rule=NightRule.from_option(room_setting.get('night_rule', NightRule.as_options()[0])),
+                wolf_vote_rule=WolfVoteRule.from_option(
+                    room_setting.get('wolf_vote_rule', WolfVoteRule.as_options()[0])),
+                auto_start=auto_start,
+                reserved=0,
+                seed=seed,
+                rng=random.Random(seed),
                 # Dynamic
                 started=False,
                 roles_pool=copy(roles),
                 players=dict(),
                 round=0,
                 stage=None,
+                parallel_stages=list(),
                 waiting=False,
+                wolf_votes=dict(),
+                wolf_tally=Counter(),
+                alive_version=0,
+                widget_cache=dict(),
+                chat=dict(
+                    wolf=ChatChannel.alloc('wolf', [GameStage.WOLF], lobby=False),
+                    all=ChatChannel.alloc('all', [GameStage.Day], lobby=True),
+                    dead=ChatChannel.alloc('dead', list(GameStage) + [None], lobby=True),
+                ),
                 log=list(),
+                log_base=0,
+                log_bytes=0,
                 # Internal
                 logic_thread=None,
+                tasks=list(),
+                created_at=time.monotonic(),
+                last_active=time.monotonic(),
+                closed=False,
             )
         )
 
@@ -312,8 +667,12 @@ class Room:
 
     @classmethod
     def validate_room_join(cls, room_id):
+        if Global.draining:
+            return 'The server is restarting'
         room = cls.get(room_id)
         if not room:
             return 'The room does not exist'
         if room.is_full():
             return 'room is full'
+        if len(room.players) + room.reserved >= len(room.roles):
+            return 'The room is reserved for matched players'
@@ -1,4 +1,5 @@
-from typing import Dict, TYPE_CHECKING
+import random
+from typing import Dict, Optional, TYPE_CHECKING
 
 from utils import rand_int
 
@@ -8,11 +9,81 @@ if TYPE_CHECKING:
 
 class Config:
     SYS_NICK = '📢'
+    SEED: Optional[int] = None  # Server-wide seed, makes room ids and every room seed reproducible
+
+    # Server, overridable from the command line, see main.py --help
+    HOST = '0.0.0.0'
+    PORT = 80
+    TTS_BACKEND: Optional[str] = None  # Key of utils.TTS_BACKENDS, None to pick by platform
+    ADDRESS_BACKEND = 'hostname'  # Key of utils.ADDRESS_BACKENDS, 'udp' probes the default route instead
+
+    # Room lifecycle, seconds
+    ROOM_IDLE_TTL = 10 * 60  # Room waiting for players
+    ROOM_GAME_IDLE_TTL = 30 * 60  # Room with a game in progress
+    REAPER_INTERVAL = 30
+
+    # Memory, see models.memory
+    ROOM_MEMORY_CAP = 16 * 1024 * 1024  # Bytes per room, None to disable
+    ROOM_LOG_KEEP = 1000  # Log entries kept when a room over the cap is compacted
+    TRACEMALLOC_FRAMES = 1
+
+    # Drain mode for restarts
+    DRAIN_TIMEOUT = 60 * 60  # Seconds to wait for running games before exiting
+    DRAIN_SIGNAL = 'SIGTERM'  # None to disable
+    HANDOFF_URL = None  # Address of the replacement server, new sessions are redirected there
+    ADMIN_TOKEN = None  # Enables the admin app (?app=admin) when set
+
+    # Logging, see utils.setup_logging
+    LOG_MODE = 'queue'  # 'sync' / 'queue'
+    LOG_FORMAT = 'text'  # 'text' / 'json'
+    LOG_QUEUE_SIZE = 10000
+    LOG_DEBUG_RATE = 20  # DEBUG records per second per room, None for no limit
+
+    # Wolf consensus vote, see WolfVoteRule
+    WOLF_VOTE_TIMEOUT = 60  # Seconds before the plurality target is killed
+
+    # Chat
+    CHAT_HISTORY = 100  # Messages kept per channel and per player inbox
+    CHAT_RATE_LIMIT = (5, 10)  # At most 5 messages per 10 seconds per player and channel
+
+    # Matchmaking
+    MATCH_WIDEN_AFTER = 60  # Seconds before a waiting player accepts any preset
+    MATCH_JOIN_GRACE = 30  # Seconds an empty matched room waits for its players
+    ROOM_PRESETS = {
+        '6 players: prophet, witch': dict(
+            wolf_num=2, god_wolf=[], citizen_num=2, god_citizen=['Prophet', 'Witch'],
+            witch_rule='Only the first night can save yourself',
+            guard_rule='The object dies when guarded and rescued at the same time',
+        ),
+        '9 players: prophet, witch, hunter': dict(
+            wolf_num=3, god_wolf=[], citizen_num=3, god_citizen=['Prophet', 'Witch', 'Hunter'],
+            witch_rule='Only the first night can save yourself',
+            guard_rule='The object dies when guarded and rescued at the same time',
+        ),
+        '9 players: prophet, witch, guard, fast night': dict(
+            wolf_num=3, god_wolf=[], citizen_num=3, god_citizen=['Prophet', 'Witch', 'Guard'],
+            witch_rule='Only the first night can save yourself',
+            guard_rule='The object dies when guarded and rescued at the same time',
+            night_rule='Wolves, prophet and guard act at the same time',
+        ),
+        '12 players: wolf king, all gods': dict(
+            wolf_num=3, god_wolf=['Wolf King'], citizen_num=4, god_citizen=['Prophet', 'Witch', 'Guard', 'Hunter'],
+            witch_rule='Only the first night can save yourself',
+            guard_rule='The object dies when guarded and rescued at the same time',
+        ),
+    }
 
 
 class Global:
     users = dict()
     rooms: Dict[str, 'Room'] = dict()
+    draining = False  # No new rooms or games, see Lifecycle.start_drain
+    rng = random.Random(Config.SEED)  # Room ids and room seeds
+
+    @classmethod
+    def seed(cls, seed: Optional[int]):
+        """Reseed the server RNG, rooms allocated afterwards replay identically"""
+        cls.rng = random.Random(seed)
 
     @classmethod
     def reg_room(cls, room: 'Room') -> 'Room':
@@ -21,7 +92,7 @@ class Global:
 
         latest_room: list = list(cls.rooms.keys())[-1:]
         if not latest_room:
-            alloc_room_id = rand_int()
+            alloc_room_id = rand_int(rng=cls.rng)
         else:
             alloc_room_id = cls.rooms[latest_room[0]].id + 1
 
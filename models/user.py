@@ -1,13 +1,14 @@
 import asyncio
+from collections import deque
 from dataclasses import dataclass
-from typing import Optional, TYPE_CHECKING, Any
+from typing import Optional, TYPE_CHECKING, Any, Deque
 
 from pywebio import run_async
 from pywebio.output import output
 from pywebio.session import get_current_session
 from pywebio.session.coroutinebased import TaskHandle
 
-from enums import Role, PlayerStatus, LogCtrl, WitchRule, GuardRule, GameStage
+from enums import Role, PlayerStatus, LogCtrl, WitchRule, GuardRule, NightRule, WolfVoteRule, GameStage
 from models.system import Config, Global
 from stub import OutputHandler
 from . import logger
@@ -16,25 +17,36 @@ if TYPE_CHECKING:
     from .room import Room
 
 
+STAGE_ROLES = {
+    GameStage.Day: [],
+    GameStage.GUARD: [Role.GUARD],
+    GameStage.WITCH: [Role.WITCH],
+    GameStage.HUNTER: [Role.HUNTER],
+    GameStage.DETECTIVE: [Role.DETECTIVE],
+    GameStage.WOLF: [Role.WOLF, Role.WOLF_KING],
+}
+
+
 def player_action(func):
     """
     Player operation waits to unlock logic decorator
 
     1. Only used for game character operations under the User class
     2. When the decorated function returns a string, it will return an error message to the current user and continue to lock
-    3. When None / True is returned, the game stage will be unlocked
+    3. When None / True is returned, the stage of the player will be unlocked
+    4. When False is returned, the stage stays locked without any message
     """
 
     def wrapper(self: 'User', *args, **kwargs):
         if self.room is None or self.room.waiting is not True:
             return
-        if not self.should_act():
+        stage = self.acting_stage()
+        if stage is None:
             return
 
         rv = func(self, *args, **kwargs)
         if rv in [None, True]:
-            self.room.waiting = False
-            self.room.enter_null_stage()
+            self.room.finish_stage(stage)
         if isinstance(rv, str):
             self.send_msg(text=rv)
 
@@ -58,6 +70,7 @@ class User:
 
     game_msg: OutputHandler  # Game log UI Handler
     game_msg_syncer: Optional[TaskHandle]  # Game log synchronization thread
+    chat_inbox: Deque[str]  # Chat lines waiting for the syncer, filled by ChatChannel.post
 
     def __str__(self):
         return self.nick
@@ -73,34 +86,44 @@ class User:
             logger.warning(
                 'User.send_msg() was called when the player did not enter the room state')
 
+    def _sync_game_msg(self, last_idx: int) -> int:
+        """
+        Render self.room.log entries after last_idx into self.game_msg, return the new index
+
+        Indexes are absolute, they stay valid when the room log is compacted
+        """
+        for msg in self.room.log[max(last_idx - self.room.log_base, 0):]:
+            if msg[0] == self.nick:
+                self.game_msg.append(f'👂:{msg[1]}')
+            elif msg[0] == Config.SYS_NICK:
+                self.game_msg.append(f'📢:{msg[1]}')
+            elif msg[0] is None:
+                if msg[1] == LogCtrl.RemoveInput:
+                    # Workaround, see https://github.com/wang0618/PyWebIO/issues/32
+                    if self.input_blocking:
+                        get_current_session().send_client_event({
+                            'event': 'from_cancel',
+                            'task_id': self.main_task_id,
+                            'data': None
+                        })
+
+        while self.chat_inbox:
+            self.game_msg.append(self.chat_inbox.popleft())
+
+        # clean up records
+        if len(self.room.log) > 50000:
+            self.room.compact_log(len(self.room.log) // 2)
+        return self.room.log_base + len(self.room.log)
+
     async def _game_msg_syncer(self):
         """
         Sync self.game_msg and self.room.log
 
         Managed by Room and runs on the main Task thread of the user session
         """
-        last_idx = len(self.room.log)
+        last_idx = self.room.log_base + len(self.room.log)
         while True:
-            for msg in self.room.log[last_idx:]:
-                if msg[0] == self.nick:
-                    self.game_msg.append(f'👂:{msg[1]}')
-                elif msg[0] == Config.SYS_NICK:
-                    self.game_msg.append(f'📢:{msg[1]}')
-                elif msg[0] is None:
-                    if msg[1] == LogCtrl.RemoveInput:
-                        # Workaround, see https://github.com/wang0618/PyWebIO/issues/32
-                        if self.input_blocking:
-                            get_current_session().send_client_event({
-                                'event': 'from_cancel',
-                                'task_id': self.main_task_id,
-                                'data': None
-                            })
-
-            # clean up records
-            if len(self.room.log) > 50000:
-                self.room.log = self.room.log[len(self.room.log) // 2:]
-            last_idx = len(self.room.log)
-
+            last_idx = self._sync_game_msg(last_idx)
             await asyncio.sleep(0.2)
 
     def start_syncer(self):
@@ -117,17 +140,18 @@ class User:
         self.game_msg_syncer = None
 
     # player state
+    def acting_stage(self) -> Optional[GameStage]:
+        """The current stage in which the player should operate, if any"""
+        if self.status == PlayerStatus.DEAD:
+            return None
+        for stage in self.room.current_stages():
+            if self.role in STAGE_ROLES[stage]:
+                return stage
+        return None
+
     def should_act(self):
         """Currently in the stage of the player's operation"""
-        stage_map = {
-            GameStage.Day: [],
-            GameStage.GUARD: [Role.GUARD],
-            GameStage.WITCH: [Role.WITCH],
-            GameStage.HUNTER: [Role.HUNTER],
-            GameStage.DETECTIVE: [Role.DETECTIVE],
-            GameStage.WOLF: [Role.WOLF, Role.WOLF_KING],
-        }
-        return self.role in stage_map.get(self.room.stage, []) and self.status != PlayerStatus.DEAD
+        return self.acting_stage() is not None
 
     def witch_has_heal(self):
         """The witch holds the antidote"""
@@ -138,12 +162,24 @@ class User:
         return self.skill.get('poison') is True
     # player action
 
+    def chat(self, text: str):
+        """Speak in the chat channel currently open to the player"""
+        channel = self.room.chat_channel_for(self)
+        if channel is None:
+            return
+        error = channel.post(self.room, self.nick, text)
+        if error:
+            self.send_msg(error)
+
     @player_action
     def skip(self):
-        pass
+        if self.acting_stage() == GameStage.WOLF and self.room.wolf_vote_rule != WolfVoteRule.FIRST:
+            return self.room.wolf_vote(self, None)
 
     @player_action
     def wolf_kill_player(self, nick):
+        if self.room.wolf_vote_rule != WolfVoteRule.FIRST:
+            return self.room.wolf_vote(self, nick)
         self.room.players[nick].status = PlayerStatus.PENDING_DEAD
 
     @player_action
@@ -175,6 +211,15 @@ class User:
         if self.skill['last_protect'] == nick:
             return 'Do not guard the same player for two nights'
 
+        if self.room.night_rule == NightRule.CONCURRENT:
+            # Resolved after the witch by Room.apply_deferred_guard
+            self.skill['protect'] = nick
+            return
+
+        self.protect(nick)
+
+    def protect(self, nick):
+        """Apply the guard protection on a player"""
         if self.room.players[nick].status == PlayerStatus.PENDING_HEAL and \
                 self.room.guard_rule == GuardRule.MED_CONFLICT:
             # Conflict with the same guard and the same salvation
@@ -213,9 +258,10 @@ class User:
             skill=dict(),
             status=None,
             game_msg=output(),
-            game_msg_syncer=None
+            game_msg_syncer=None,
+            chat_inbox=deque(maxlen=Config.CHAT_HISTORY),
         )
-        logger.info(f'user "{nick}" logged in')
+        logger.info(f'user "{nick}" logged in', extra={'user': nick})
         return Global.users[nick]
 
     @ classmethod
@@ -225,4 +271,4 @@ class User:
         # remove user from room
         if user.room:
             user.room.remove_player(user)
-        logger.info(f'User "{user.nick}" logged out')
+        logger.info(f'User "{user.nick}" logged out', extra={'user': user.nick})
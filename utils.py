@@ -1,45 +1,264 @@
+import atexit
+import json
+import logging
+import queue
 import random
 import socket
 import subprocess
+import sys
 import threading
-import traceback
+import time
 from logging import getLogger
+from logging.handlers import QueueHandler, QueueListener
 from sys import platform
-
-import pyttsx3
+from typing import Optional
 
 logger = getLogger('Utils')
 logger.setLevel('DEBUG')
 
 
-def rand_int(min_value=0, max_value=100):
-    return random.randint(min_value, max_value)
+def rand_int(min_value=0, max_value=100, rng: random.Random = random):
+    return rng.randint(min_value, max_value)
 
 
-def say(text):
+# TTS backends, the platform drivers are imported on first use only
+def _say_macos(text):
+    subprocess.Popen(['say', '-r', '10000', text])
+
+
+def _say_pyttsx3(text):
+    import pyttsx3
+
+    def wrapper():
+        tts = pyttsx3.init()
+        tts.say(text)
+        tts.runAndWait()
+
+    threading.Thread(target=wrapper).start()
+
+
+def _say_none(text):
+    pass
+
+
+TTS_BACKENDS = {
+    'say': _say_macos,
+    'pyttsx3': _say_pyttsx3,
+    'none': _say_none,
+}
+_tts_backend: Optional[str] = None  # None means picking by platform on first use
+
+
+def _default_tts_backend() -> str:
     if platform == "darwin":
-        subprocess.Popen(['say', '-r', '10000', text])
-    elif platform == "win32":
-        def wrapper():
-            tts = pyttsx3.init()
-            tts.say(text)
-            tts.runAndWait()
+        return 'say'
+    if platform == "win32":
+        return 'pyttsx3'
+    logger.warning(f'{platform} does not support TTS voice broadcast')
+    return 'none'
 
-        threading.Thread(target=wrapper).start()
 
-    else:
-        logger.warning(f'{platform} does not support TTS voice broadcast')
+def say(text):
+    global _tts_backend
+    if _tts_backend is None:
+        _tts_backend = _default_tts_backend()
+    TTS_BACKENDS[_tts_backend](text)
 
 
-def get_interface_ip() -> str:
+# Address discovery backends, used for the startup banner
+def _probe_udp() -> str:
+    """Local address of the default route, no packet is sent"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(('8.8.8.8', 80))
-        return s.getsockname()[0] or 'Get failed'
-    except Exception:
-        traceback.print_exc()
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+def _probe_hostname() -> str:
+    return socket.gethostbyname(socket.gethostname())
+
+
+ADDRESS_BACKENDS = {
+    'udp': _probe_udp,
+    'hostname': _probe_hostname,
+    'none': lambda: '',
+}
+_address_backend = 'hostname'
+
+
+def configure_backends(tts: Optional[str] = None, address: Optional[str] = None):
+    """
+    Select the TTS and address discovery backends by name
+
+    :param tts: key of TTS_BACKENDS, None to pick by platform
+    :param address: key of ADDRESS_BACKENDS
+    """
+    global _tts_backend, _address_backend
+    if tts is not None and tts not in TTS_BACKENDS:
+        raise ValueError(tts)
+    if address is not None and address not in ADDRESS_BACKENDS:
+        raise ValueError(address)
+    _tts_backend = tts
+    if address is not None:
+        _address_backend = address
+
+
+def get_interface_ip() -> str:
+    try:
+        return ADDRESS_BACKENDS[_address_backend]() or 'Get failed'
+    except Exception as e:
+        logger.warning(f'Address discovery with the "{_address_backend}" backend failed: {e!r}')
         return 'Get failed'
 
 
+class StartupProfile:
+    """Wall clock time of the startup steps, see main.py --profile-startup"""
+
+    def __init__(self, started: float):
+        self.last = started
+        self.steps = []  # (step, seconds)
+
+    def mark(self, step: str):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def report(self) -> str:
+        lines = [f'{step:<24} {seconds * 1000:>8.1f} ms' for step, seconds in self.steps]
+        lines.append(f'{"total":<24} {sum(seconds for _, seconds in self.steps) * 1000:>8.1f} ms')
+        lines.append(f'{len(sys.modules)} modules loaded, run with python -X importtime for a per module breakdown')
+        return '\n'.join(lines)
+
+
 def add_cancel_button(buttons: list):
     return buttons + [{'label': 'cancel', 'type': 'cancel'}]
+
+
+def input_spec(single_input) -> dict:
+    """
+    Unwrap a named input function result, e.g. actions(name=...), into the dict input_group accepts
+
+    The result of the input function can be consumed by one form only, the dict can be shared by any number of forms
+    """
+    try:
+        single_input.send(None)
+    except StopIteration as e:
+        return e.args[0]
+    except AttributeError:
+        return single_input
+    raise RuntimeError("Can't get kwargs from single input")
+
+
+# Logging
+TEXT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_CONTEXT_FIELDS = ('room', 'user')  # Passed with logger.xxx(..., extra={'room': room.id})
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the room / user context fields when present"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        for field in LOG_CONTEXT_FIELDS:
+            if getattr(record, field, None) is not None:
+                data[field] = getattr(record, field)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RoomDebugRateLimit(logging.Filter):
+    """Let at most `rate` DEBUG records per second through for each room"""
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self.windows = dict()  # room -> (second, count)
+        self.dropped = 0
+
+    def filter(self, record):
+        room = getattr(record, 'room', None)
+        if record.levelno > logging.DEBUG or room is None:
+            return True
+
+        now = int(time.monotonic())
+        second, count = self.windows.get(room, (now, 0))
+        if second != now:
+            if len(self.windows) > 10000:
+                self.windows.clear()
+            count = 0
+        if count >= self.rate:
+            self.dropped += 1
+            return False
+        self.windows[room] = (now, count + 1)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Enqueue records for a QueueListener thread without ever blocking the event loop
+
+    Formatting is left to the listener thread, records are dropped and counted when the queue is full
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_log_handler: Optional[logging.Handler] = None
+
+
+def setup_logging(mode='sync', fmt='text', queue_size=10000, debug_rate: Optional[int] = None):
+    """
+    Install the root log handler
+
+    :param mode: 'sync' writes from the calling thread, 'queue' writes from a background thread
+    :param fmt: 'text' or 'json'
+    :param queue_size: records kept in 'queue' mode before dropping
+    :param debug_rate: max DEBUG records per second per room, None for no limit
+    """
+    global _log_handler
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_LOG_FORMAT))
+
+    if mode == 'queue':
+        log_queue = queue.Queue(queue_size)
+        listener = QueueListener(log_queue, handler)
+        listener.start()
+        atexit.register(listener.stop)
+        handler = DroppingQueueHandler(log_queue)
+    elif mode != 'sync':
+        raise ValueError(mode)
+
+    if debug_rate is not None:
+        handler.addFilter(RoomDebugRateLimit(debug_rate))
+    logging.getLogger().addHandler(handler)
+    _log_handler = handler
+
+
+def log_drop_count() -> int:
+    """Records dropped by the queue or the per room rate limit since setup_logging"""
+    if _log_handler is None:
+        return 0
+    dropped = getattr(_log_handler, 'dropped', 0)
+    dropped += sum(f.dropped for f in _log_handler.filters if isinstance(f, RoomDebugRateLimit))
+    return dropped